@@ -23,29 +23,45 @@ MODEL_CONFIGS = {
         'device': 'cuda',
         'language': 'en',
         'region': 'US',
+        'concurrency': 1,  # Files transcribed in parallel by process_dataset
     },
     'whisper': {
         'model_id': 'openai/whisper-large-v3-turbo',
+        'backend': 'hf',  # 'hf', 'bnb-int8' (bitsandbytes int8 weights) or 'faster-whisper'
+        'faster_whisper_model_id': 'large-v3-turbo',  # CTranslate2 model for the faster-whisper backend
+        'compute_type': None,  # faster-whisper only; defaults to int8_float16 on CUDA, int8 otherwise
         'device': None,  # Will be auto-detected (cuda, mps, or cpu)
-        'batch_size': 1,
+        'batch_size': None,  # Files per pipeline call; defaults to 8 on CUDA, 1 otherwise
         'language': 'en',
+        'attn_implementation': 'sdpa',  # or 'flash_attention_2' if flash-attn is installed
+        'torch_compile': True,  # CUDA only; compiles forward and warms up at load
+        'audio_cache_dir': None,  # Set to a directory to cache decoded 16 kHz audio as .npy
+        'concurrency': 1,
     },
     'google': {
         'language_code': 'en-US',
+        'gcs_bucket': None,  # Set to stage files over 10 MB in GCS for longRunningRecognize
+        'concurrency': 8,
     },
     'aws': {
         'language_code': 'en-US',
-        'max_concurrent_jobs': 90,
         'output_prefix': 'transcripts',
+        'concurrency': 16,  # Transcribe jobs in flight at once (one per worker thread)
     },
     'salad': {
         'organization': 'nurix-ai',
+        'concurrency': 8,
+        'webhook_url': None,  # Public URL for job-completion webhooks; None polls only
+        'webhook_host': '127.0.0.1',  # Interface the webhook listener binds to
+        'webhook_port': 8080,
+        'webhook_secret': None,  # Signing secret from the Salad portal, or SALAD_WEBHOOK_SECRET
     },
     'deepgram': {
         'model': 'nova-3',
         'language': 'en',
         'punctuate': True,
         'smart_format': True,
+        'concurrency': 8,
     }
 }
 
@@ -54,6 +70,10 @@ OUTPUT_CONFIG = {
     'base_dir': 'transcription_results',
     'csv_filename': 'results.csv',
     'max_audio_duration': 10 * 3600,  # 10 hours in seconds
+    'prefetch_batches': 4,  # Batches downloaded ahead of the transcription workers
+    'pretty_json': False,  # Indent per-file JSON results (slower, larger files)
+    'use_cache': True,  # Reuse results for audio already transcribed with the same model settings
+    'cache_dir': 'transcription_cache',
 }
 
 # Available Models
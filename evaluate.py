@@ -8,16 +8,153 @@ import os
 import json
 import csv
 import argparse
-import glob
-from jiwer import wer, cer
-import pandas as pd
+import hashlib
+import pickle
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
 
-def load_reference_transcripts(reference_path):
+from normalization import NORMALIZATION, normalize_transcript
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+RESULT_COLUMNS = ['file_id', 'reference', 'hypothesis', 'wer', 'cer']
+
+def _lev_bounded(a, b, k):
+    """
+    Levenshtein distance between a (the shorter sequence) and b, only filling
+    cells within k of the diagonal (Ukkonen banding). Returns k + 1 if the
+    distance exceeds k.
+    """
+    n, m = len(a), len(b)
+    big = k + 1
+    if m - n > k:
+        return big
+    
+    # Two rolling rows over the shorter sequence
+    prev = array('i', [i if i <= k else big for i in range(n + 1)])
+    cur = array('i', [big]) * (n + 1)
+    
+    for j in range(1, m + 1):
+        bj = b[j - 1]
+        lo = max(1, j - k)
+        hi = min(n, j + k)
+        cur[lo - 1] = j if lo == 1 and j <= k else big
+        for i in range(lo, hi + 1):
+            v = prev[i - 1] + (a[i - 1] != bj)
+            d = prev[i] + 1
+            if d < v:
+                v = d
+            d = cur[i - 1] + 1
+            if d < v:
+                v = d
+            cur[i] = v if v < big else big
+        if hi < n:
+            cur[hi + 1] = big
+        prev, cur = cur, prev
+    
+    return prev[n]
+
+def _lev(a, b):
+    """
+    Pure-Python Levenshtein distance over strings or token sequences, used
+    when rapidfuzz is not installed. Memory is O(min(N, M)); the band is
+    doubled until the distance fits inside it.
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    if not a:
+        return len(b)
+    
+    k = max(len(b) - len(a), 1)
+    while True:
+        distance = _lev_bounded(a, b, k)
+        if distance <= k:
+            return distance
+        k *= 2
+
+try:
+    from rapidfuzz.distance.Levenshtein import distance as _distance
+except ImportError:
+    _distance = _lev
+
+try:
+    # Element-wise batch scoring; needs rapidfuzz >= 3.6
+    from rapidfuzz.process import cpdist
+except ImportError:
+    cpdist = None
+
+@lru_cache(maxsize=8192)
+def _tokenize(text):
+    """
+    Normalize a transcript (as transcribe.py does before scoring) and split it
+    into words, memoized for repeated references.
+    """
+    return tuple(normalize_transcript(text).split())
+
+def _find(root, suffix, recursive=True):
+    """
+    Yield paths of files under root whose names end with suffix, walking the
+    tree iteratively with os.scandir. Hidden entries are skipped, as glob does.
+    """
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except (FileNotFoundError, NotADirectoryError):
+            # A missing directory matches nothing, as with glob
+            continue
+        with it:
+            for entry in it:
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    if recursive:
+                        stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield entry.path
+
+def _parse_trans_file(trans_file, transcript_dict):
+    """
+    Add the "<file_id> <TRANSCRIPT>" lines of a .trans.txt file to transcript_dict.
+    The file is read and decoded in one call rather than line by line.
+    """
+    with open(trans_file, 'rb') as f:
+        data = f.read().decode('utf-8')
+    
+    for line in data.splitlines():
+        parts = line.strip().split(' ', 1)
+        if len(parts) == 2:
+            key, transcript = parts
+            transcript_dict[key] = transcript.lower()
+
+def _reference_cache_key(reference_path, trans_files):
+    """
+    Key the parsed reference dict on the list of .trans.txt files and the
+    modification times of the directories holding them. Only directories are
+    stat'ed, so additions, removals and renames (including editors' atomic
+    saves) invalidate the cache, but a file rewritten in place does not.
+    """
+    digest = hashlib.sha1(os.path.abspath(reference_path).encode('utf-8'))
+    trans_files = sorted(trans_files)
+    directories = sorted({reference_path, *map(os.path.dirname, trans_files)})
+    for path in directories + trans_files:
+        digest.update(path.encode('utf-8'))
+    for directory in directories:
+        digest.update(str(os.stat(directory).st_mtime_ns).encode('ascii'))
+    return digest.hexdigest()
+
+def load_reference_transcripts(reference_path, cache_dir=None):
     """
     Load reference transcripts from a file or directory.
     
     Parameters:
         reference_path (str): Path to a .trans.txt file or directory containing .trans.txt files
+        cache_dir (str, optional): Directory for caching parsed directory references between runs;
+            no caching when not given
         
     Returns:
         dict: Mapping of file ids to reference transcripts
@@ -26,31 +163,59 @@ def load_reference_transcripts(reference_path):
     
     if os.path.isdir(reference_path):
         # Find all .trans.txt files in the directory
-        trans_files = glob.glob(os.path.join(reference_path, "**/*.trans.txt"), recursive=True)
+        trans_files = list(_find(reference_path, '.trans.txt'))
+        
+        cache_path = None
+        if cache_dir:
+            key = _reference_cache_key(reference_path, trans_files)
+            cache_path = os.path.join(cache_dir, f"{key}.pkl")
+            if os.path.exists(cache_path):
+                with open(cache_path, 'rb') as f:
+                    return pickle.load(f)
+        
         for trans_file in trans_files:
-            with open(trans_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    parts = line.strip().split(' ', 1)
-                    if len(parts) == 2:
-                        key, transcript = parts
-                        transcript_dict[key] = transcript.lower()
+            _parse_trans_file(trans_file, transcript_dict)
+        
+        if cache_path:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(transcript_dict, f, protocol=5)
+            os.replace(tmp_path, cache_path)
     else:
         # Load a single transcript file
-        with open(reference_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split(' ', 1)
-                if len(parts) == 2:
-                    key, transcript = parts
-                    transcript_dict[key] = transcript.lower()
+        _parse_trans_file(reference_path, transcript_dict)
     
     return transcript_dict
 
-def load_hypothesis_transcripts(hypothesis_path):
+def _load_one(json_file):
+    """
+    Read a single hypothesis JSON file.
+    
+    Returns:
+        tuple: (file_id, lowercased transcript), or (file_id, None) if the file
+        has no text or could not be parsed
+    """
+    file_id = os.path.splitext(os.path.basename(json_file))[0]
+    with open(json_file, 'rb') as f:
+        try:
+            data = orjson.loads(f.read()) if orjson else json.load(f)
+        except json.JSONDecodeError:
+            print(f"Warning: Could not parse JSON file {json_file}")
+            return file_id, None
+    
+    # Extract the transcript text
+    if 'text' in data:
+        return file_id, data['text'].lower()
+    return file_id, None
+
+def load_hypothesis_transcripts(hypothesis_path, max_workers=32):
     """
-    Load hypothesis transcripts from JSON files.
+    Load hypothesis transcripts from JSON files, reading files concurrently.
     
     Parameters:
         hypothesis_path (str): Path to directory containing JSON files
+        max_workers (int): Number of reader threads
         
     Returns:
         dict: Mapping of file ids to hypothesis transcripts
@@ -58,85 +223,132 @@ def load_hypothesis_transcripts(hypothesis_path):
     hypothesis_dict = {}
     
     # Find all JSON files in the directory
-    json_files = glob.glob(os.path.join(hypothesis_path, "*.json"))
-    
-    for json_file in json_files:
-        file_id = os.path.splitext(os.path.basename(json_file))[0]
-        with open(json_file, 'r', encoding='utf-8') as f:
-            try:
-                data = json.load(f)
-                # Extract the transcript text
-                if 'text' in data:
-                    hypothesis_dict[file_id] = data['text'].lower()
-            except json.JSONDecodeError:
-                print(f"Warning: Could not parse JSON file {json_file}")
+    json_files = list(_find(hypothesis_path, '.json', recursive=False))
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for file_id, text in executor.map(_load_one, json_files):
+            if text is not None:
+                hypothesis_dict[file_id] = text
     
     return hypothesis_dict
 
-def calculate_metrics(references, hypotheses):
+def _score(item):
+    """
+    Calculate WER and CER for a single (file_id, reference, hypothesis) triple.
+    Kept at module level so it can be pickled into worker processes.
+    """
+    file_id, reference, hypothesis = item
+    ref_words = _tokenize(reference)
+    hyp_words = _tokenize(hypothesis)
+    file_wer = _distance(ref_words, hyp_words) / max(len(ref_words), 1)
+    
+    # CER is normalized by the reference length (as jiwer does), on
+    # whitespace-collapsed text
+    ref_chars = ' '.join(ref_words)
+    file_cer = _distance(ref_chars, ' '.join(hyp_words)) / max(len(ref_chars), 1)
+    
+    return {
+        'file_id': file_id,
+        'reference': reference,
+        'hypothesis': hypothesis,
+        'wer': file_wer,
+        'cer': file_cer
+    }
+
+def _score_batch(pairs):
+    """
+    Calculate WER and CER for all (file_id, reference, hypothesis) triples with
+    two rapidfuzz cpdist calls, which run in C++ threads across all cores.
+    """
+    ref_words = [_tokenize(reference) for _, reference, _ in pairs]
+    hyp_words = [_tokenize(hypothesis) for _, _, hypothesis in pairs]
+    ref_chars = [' '.join(words) for words in ref_words]
+    hyp_chars = [' '.join(words) for words in hyp_words]
+    
+    word_distances = cpdist(ref_words, hyp_words, scorer=_distance, workers=-1)
+    char_distances = cpdist(ref_chars, hyp_chars, scorer=_distance, workers=-1)
+    
+    for i, (file_id, reference, hypothesis) in enumerate(pairs):
+        yield {
+            'file_id': file_id,
+            'reference': reference,
+            'hypothesis': hypothesis,
+            'wer': int(word_distances[i]) / max(len(ref_words[i]), 1),
+            'cer': int(char_distances[i]) / max(len(ref_chars[i]), 1)
+        }
+
+def iter_metrics(references, hypotheses):
     """
-    Calculate WER and CER metrics for each file.
+    Calculate WER and CER metrics for each file, spread across all CPU cores.
+    Uses rapidfuzz's batch scorer when available, otherwise a process pool.
     
     Parameters:
         references (dict): Mapping of file ids to reference transcripts
         hypotheses (dict): Mapping of file ids to hypothesis transcripts
         
-    Returns:
-        list: List of dictionaries with file_id, reference, hypothesis, wer, and cer
-    """
-    results = []
-    
-    for file_id, reference in references.items():
-        if file_id in hypotheses:
-            hypothesis = hypotheses[file_id]
-            file_wer = wer(reference, hypothesis)
-            file_cer = cer(reference, hypothesis)
-            
-            results.append({
-                'file_id': file_id,
-                'reference': reference,
-                'hypothesis': hypothesis,
-                'wer': file_wer,
-                'cer': file_cer
-            })
-    
-    return results
+    Yields:
+        dict: file_id, reference, hypothesis, wer, and cer for each matched file
+    """
+    # References that are empty after normalization (only punctuation) are
+    # skipped, as transcribe.py does, since WER is undefined for them
+    pairs = [(file_id, reference, hypotheses[file_id])
+             for file_id, reference in references.items()
+             if file_id in hypotheses and _tokenize(reference)]
+    if not pairs:
+        return
+    
+    if cpdist is not None:
+        yield from _score_batch(pairs)
+        return
+    
+    with ProcessPoolExecutor() as executor:
+        yield from executor.map(_score, pairs, chunksize=64)
 
 def save_results_to_csv(results, output_csv):
     """
-    Save evaluation results to CSV.
+    Stream evaluation results to CSV, keeping only running totals in memory.
     
     Parameters:
-        results (list): List of result dictionaries
+        results (iterable): Result dictionaries, e.g. from iter_metrics
         output_csv (str): Path to output CSV file
+        
+    Returns:
+        dict: Summary with avg_wer, avg_cer, and num_files
     """
+    wer_sum = 0.0
+    cer_sum = 0.0
+    count = 0
+    
     with open(output_csv, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['file_id', 'reference', 'hypothesis', 'wer', 'cer']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(results)
+        writer = csv.writer(csvfile, lineterminator='\n')
+        writer.writerow(RESULT_COLUMNS)
+        for row in results:
+            writer.writerow([row['file_id'], row['reference'], row['hypothesis'], row['wer'], row['cer']])
+            wer_sum += row['wer']
+            cer_sum += row['cer']
+            count += 1
+    
+    return {
+        'avg_wer': wer_sum / count if count > 0 else 0,
+        'avg_cer': cer_sum / count if count > 0 else 0,
+        'num_files': count,
+        'text_normalization': NORMALIZATION
+    }
 
-def save_summary(results, output_json):
+def save_summary(summary, output_json):
     """
     Save summary metrics to JSON.
     
     Parameters:
-        results (list): List of result dictionaries
+        summary (dict): Summary metrics, as returned by save_results_to_csv
         output_json (str): Path to output JSON file
     """
-    if not results:
-        summary = {'avg_wer': 0, 'avg_cer': 0, 'num_files': 0}
+    if orjson:
+        with open(output_json, 'wb') as f:
+            f.write(orjson.dumps(summary, option=orjson.OPT_INDENT_2))
     else:
-        avg_wer = sum(r['wer'] for r in results) / len(results)
-        avg_cer = sum(r['cer'] for r in results) / len(results)
-        summary = {
-            'avg_wer': avg_wer,
-            'avg_cer': avg_cer,
-            'num_files': len(results)
-        }
-    
-    with open(output_json, 'w', encoding='utf-8') as f:
-        json.dump(summary, f, indent=2)
+        with open(output_json, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
 
 def main():
     parser = argparse.ArgumentParser(description='Evaluate speech transcription results')
@@ -144,37 +356,33 @@ def main():
     parser.add_argument('--hypothesis', required=True, help='Path to hypothesis JSON files directory')
     parser.add_argument('--output-csv', default='evaluation_results.csv', help='Path to output CSV file')
     parser.add_argument('--output-json', default='evaluation_summary.json', help='Path to output JSON summary file')
+    parser.add_argument('--cache-dir', help='Directory for caching parsed reference transcripts between runs (disabled by default)')
     
     args = parser.parse_args()
     
     # Load reference and hypothesis transcripts
     print(f"Loading reference transcripts from {args.reference}...")
-    references = load_reference_transcripts(args.reference)
+    references = load_reference_transcripts(args.reference, cache_dir=args.cache_dir)
     print(f"Found {len(references)} reference transcripts.")
     
     print(f"Loading hypothesis transcripts from {args.hypothesis}...")
     hypotheses = load_hypothesis_transcripts(args.hypothesis)
     print(f"Found {len(hypotheses)} hypothesis transcripts.")
     
-    # Calculate metrics
-    print("Calculating metrics...")
-    results = calculate_metrics(references, hypotheses)
-    
-    # Save results
-    print(f"Saving detailed results to {args.output_csv}...")
-    save_results_to_csv(results, args.output_csv)
+    # Calculate metrics, streaming each row straight into the CSV
+    print(f"Calculating metrics and saving detailed results to {args.output_csv}...")
+    summary = save_results_to_csv(iter_metrics(references, hypotheses), args.output_csv)
     
     print(f"Saving summary to {args.output_json}...")
-    save_summary(results, args.output_json)
+    save_summary(summary, args.output_json)
     
     # Print summary
-    if results:
-        avg_wer = sum(r['wer'] for r in results) / len(results)
-        avg_cer = sum(r['cer'] for r in results) / len(results)
+    if summary['num_files']:
         print("\nEvaluation Summary:")
-        print(f"Files evaluated: {len(results)}")
-        print(f"Average WER: {avg_wer:.4f}")
-        print(f"Average CER: {avg_cer:.4f}")
+        print(f"Files evaluated: {summary['num_files']}")
+        print(f"Average WER: {summary['avg_wer']:.4f}")
+        print(f"Average CER: {summary['avg_cer']:.4f}")
+        print(f"Text normalization: {NORMALIZATION} (not comparable with lowercase-only scores)")
     else:
         print("\nNo matching files found for evaluation.")
 
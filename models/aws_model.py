@@ -1,30 +1,46 @@
+import io
 import os
 import boto3
 import json
 import uuid
 import time
-import tempfile
+import logging
 from models.base_model import BaseModel
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+logger = logging.getLogger(__name__)
+
 class AWSModel(BaseModel):
     """AWS Transcribe speech-to-text implementation."""
     
+    accepts_s3_uri = True
+    
     def __init__(self, config):
         super().__init__(config)
         self.name = "aws"
         self.transcribe_client = None
         self.s3_client = None
+        self._transfer_cfg = None
         self.language_code = config.get('language_code', 'en-US')
-        self.max_concurrent_jobs = config.get('max_concurrent_jobs', 90)
         self.output_bucket_name = config.get('output_bucket_name')  # Will be set during transcription
         self.output_prefix = config.get('output_prefix', 'transcripts')
     
     def load(self):
         """Initialize AWS clients."""
         print("Initializing AWS Transcribe and S3 clients...")
-        self.transcribe_client = boto3.client('transcribe')
-        self.s3_client = boto3.client('s3')
+        # Size the HTTP pools for process_dataset's worker threads, which are
+        # what run jobs concurrently; each worker runs one job at a time
+        client_cfg = Config(max_pool_connections=max(self.config.get('concurrency', 1), 10))
+        self.transcribe_client = boto3.client('transcribe', config=client_cfg)
+        self.s3_client = boto3.client('s3', config=client_cfg)
+        self._transfer_cfg = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=16,
+            use_threads=True
+        )
         print("AWS clients initialized successfully.")
     
     def transcribe(self, audio_path, bucket_name=None, audio_key=None):
@@ -45,6 +61,9 @@ class AWSModel(BaseModel):
                 - text (str): The transcribed text
                 - chunks (list): Word-level information with timing
         """
+        # Objects this call creates in S3, removed again once it is done
+        uploaded_key = None
+        output_key = None
         try:
             # Generate a unique job name
             job_name = f"transcribe-{str(uuid.uuid4())}"
@@ -67,8 +86,9 @@ class AWSModel(BaseModel):
                 audio_key = f"temp-uploads/{os.path.basename(audio_path)}"
                 
                 # Upload file to S3
-                print(f"Uploading {audio_path} to s3://{bucket_name}/{audio_key}...")
-                self.s3_client.upload_file(audio_path, bucket_name, audio_key)
+                logger.debug("Uploading %s to s3://%s/%s...", audio_path, bucket_name, audio_key)
+                self.s3_client.upload_file(audio_path, bucket_name, audio_key, Config=self._transfer_cfg)
+                uploaded_key = audio_key
             
             # Configure the output location
             self.output_bucket_name = bucket_name
@@ -92,7 +112,7 @@ class AWSModel(BaseModel):
                 }
             )
             
-            print(f"Submitted transcription job {job_name}, waiting for completion...")
+            logger.debug("Submitted transcription job %s, waiting for completion...", job_name)
             
             # Wait for job to complete
             while True:
@@ -105,25 +125,17 @@ class AWSModel(BaseModel):
                 if job_status in ['COMPLETED', 'FAILED']:
                     break
                     
-                print(f"Job status: {job_status}, waiting...")
+                logger.debug("Job %s status: %s, waiting...", job_name, job_status)
                 time.sleep(5)
             
             if job_status == 'FAILED':
                 error_reason = status['TranscriptionJob'].get('FailureReason', 'Unknown error')
                 raise Exception(f"Transcription job failed: {error_reason}")
             
-            # Download the transcript result
-            with tempfile.NamedTemporaryFile(delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-            
-            self.s3_client.download_file(bucket_name, output_key, tmp_path)
-            
-            # Parse the result
-            with open(tmp_path, 'r', encoding='utf-8') as f:
-                transcript_result = json.load(f)
-            
-            # Clean up temp file
-            os.remove(tmp_path)
+            # Download the transcript result straight into memory
+            buffer = io.BytesIO()
+            self.s3_client.download_fileobj(bucket_name, output_key, buffer, Config=self._transfer_cfg)
+            transcript_result = json.loads(buffer.getvalue())
             
             # Extract text and word information
             transcript_text = transcript_result.get('results', {}).get('transcripts', [{}])[0].get('transcript', '')
@@ -146,14 +158,6 @@ class AWSModel(BaseModel):
                         'confidence': confidence
                     })
             
-            # Clean up S3 if we uploaded temporarily
-            if not audio_key or not bucket_name:
-                try:
-                    self.s3_client.delete_object(Bucket=bucket_name, Key=audio_key)
-                    self.s3_client.delete_object(Bucket=bucket_name, Key=output_key)
-                except Exception as e:
-                    print(f"Warning: Failed to clean up S3 objects: {e}")
-            
             return {
                 'text': transcript_text,
                 'chunks': word_segments,
@@ -163,4 +167,14 @@ class AWSModel(BaseModel):
         
         except Exception as e:
             print(f"Error in AWS transcription: {e}")
-            return {'text': '', 'error': str(e)}
\ No newline at end of file
+            return {'text': '', 'error': str(e)}
+        
+        finally:
+            # Remove the job's transcript output and any temporary upload; the
+            # source audio is left alone when it was transcribed in place
+            for key in (output_key, uploaded_key):
+                if key:
+                    try:
+                        self.s3_client.delete_object(Bucket=bucket_name, Key=key)
+                    except Exception as e:
+                        print(f"Warning: Failed to clean up s3://{bucket_name}/{key}: {e}")
\ No newline at end of file
@@ -3,6 +3,11 @@ from abc import ABC, abstractmethod
 class BaseModel(ABC):
     """Base class for all transcription models."""
     
+    # transcribe() also accepts raw audio file bytes instead of a path
+    accepts_bytes = False
+    # transcribe() accepts bucket_name/audio_key and reads the audio from S3 itself
+    accepts_s3_uri = False
+    
     def __init__(self, config):
         """
         Initialize the model with configuration.
@@ -38,13 +38,6 @@ class DeepgramModel(BaseModel):
                 - confidence (float): Confidence score
         """
         try:
-            with open(audio_path, "rb") as audio_file:
-                buffer_data = audio_file.read()
-                
-            payload = {
-                "buffer": buffer_data,
-            }
-            
             options = {
                 'punctuate': self.punctuate,
                 'language': self.language,
@@ -52,7 +45,13 @@ class DeepgramModel(BaseModel):
                 'smart_format': self.smart_format,
             }
             
-            response = self.client.listen.rest.v("1").transcribe_file(payload, options)
+            # Hand the SDK the open file so the request body is streamed from
+            # disk rather than buffered in memory
+            with open(audio_path, "rb") as audio_file:
+                payload = {
+                    "stream": audio_file,
+                }
+                response = self.client.listen.rest.v("1").transcribe_file(payload, options)
             
             # Extract the transcript
             transcript = response['results']['channels'][0]['alternatives'][0]['transcript']
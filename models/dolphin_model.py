@@ -3,6 +3,9 @@ import re
 import dolphin
 from models.base_model import BaseModel
 
+# Matches language/region/task and timestamp tags such as <en>, <us>, <asr>
+_TAG_RE = re.compile(r'<[^>]+>')
+
 class DolphinModel(BaseModel):
     """Dolphin speech-to-text model implementation."""
     
@@ -27,8 +30,7 @@ class DolphinModel(BaseModel):
         Remove all tags like <en>, <us>, <asr>, and timestamp tags from hypothesis text.
         """
         # Remove all tags enclosed in < >
-        cleaned_text = re.sub(r'<[^>]+>', '', text)
-        return cleaned_text.strip()
+        return _TAG_RE.sub('', text).strip()
     
     def transcribe(self, audio_path):
         """
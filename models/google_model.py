@@ -1,7 +1,10 @@
 import os
-import base64
-import requests
-import subprocess
+import uuid
+import google.auth
+from google.auth.exceptions import DefaultCredentialsError
+from google.cloud import speech_v1 as speech
+from google.cloud import storage
+from google.protobuf.json_format import MessageToDict
 from models.base_model import BaseModel
 from pathlib import Path
 
@@ -13,48 +16,45 @@ class GoogleModel(BaseModel):
         self.name = "google"
         self.api_key = os.environ.get('GOOGLE_API_KEY', config.get('api_key'))
         self.language_code = config.get('language_code', 'en-US')
+        # Files larger than this are staged in GCS and sent via longRunningRecognize
+        self.gcs_bucket = config.get('gcs_bucket')
+        self.inline_max_bytes = config.get('inline_max_bytes', 10 * 1024 * 1024)
+        self.operation_timeout = config.get('operation_timeout', 600)
+        self.credentials = None
+        self.client = None
+        self.storage_client = None
     
     def load(self):
         """Initialize Google Speech-to-Text setup."""
         # Verify API key or Google Cloud authentication
-        if not self.api_key and not self._check_gcloud_auth():
-            print("WARNING: No Google API key provided and gcloud authentication not set up.")
+        if not self.api_key and not self._load_credentials():
+            print("WARNING: No Google API key provided and Google Cloud credentials not set up.")
             print("You will need to authenticate with Google Cloud before transcription.")
         else:
+            self.client = self._create_client()
             print("Google Speech-to-Text initialized successfully.")
     
-    def _check_gcloud_auth(self):
-        """Check if gcloud authentication is set up."""
-        try:
-            result = subprocess.run(
-                ['gcloud', 'auth', 'print-access-token'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True
-            )
-            return bool(result.stdout.strip())
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            return False
-    
-    def _get_access_token(self):
-        """Get access token using gcloud command-line tool or environment."""
+    def _create_client(self):
+        """Create the gRPC Speech client, using the API key if one is configured."""
         if self.api_key:
-            return self.api_key
-            
+            return speech.SpeechClient(client_options={"api_key": self.api_key})
+        if self.credentials is None:
+            self._load_credentials()
+        return speech.SpeechClient(credentials=self.credentials)
+    
+    def _load_credentials(self):
+        """
+        Resolve application default credentials in-process. The client library
+        refreshes the token from these as it nears expiry, so no gcloud
+        subprocess is spawned per request.
+        """
         try:
-            result = subprocess.run(
-                ['gcloud', 'auth', 'print-access-token'],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                check=True
+            self.credentials, _ = google.auth.default(
+                scopes=["https://www.googleapis.com/auth/cloud-platform"]
             )
-            return result.stdout.strip()
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            print(f"Error getting access token using gcloud: {e}")
-            print("Please set the GOOGLE_API_KEY environment variable or configure gcloud.")
-            return None
+            return True
+        except DefaultCredentialsError:
+            return False
     
     def _detect_audio_format(self, file_path):
         """
@@ -87,6 +87,31 @@ class GoogleModel(BaseModel):
         
         return encoding, sample_rate_hertz
     
+    def _recognize_from_gcs(self, audio_path, config):
+        """
+        Stage a large file in GCS and transcribe it with longRunningRecognize.
+        
+        Parameters:
+            audio_path (str): Path to the audio file.
+            config (speech.RecognitionConfig): Recognition settings.
+            
+        Returns:
+            speech.LongRunningRecognizeResponse: The completed operation's response.
+        """
+        if self.storage_client is None:
+            self.storage_client = storage.Client(credentials=self.credentials)
+        
+        blob_name = f"stt-uploads/{uuid.uuid4()}/{os.path.basename(audio_path)}"
+        blob = self.storage_client.bucket(self.gcs_bucket).blob(blob_name)
+        blob.upload_from_filename(audio_path)
+        
+        try:
+            audio = speech.RecognitionAudio(uri=f"gs://{self.gcs_bucket}/{blob_name}")
+            operation = self.client.long_running_recognize(config=config, audio=audio)
+            return operation.result(timeout=self.operation_timeout)
+        finally:
+            blob.delete()
+    
     def transcribe(self, audio_path):
         """
         Transcribe the audio file using Google Speech-to-Text.
@@ -100,87 +125,63 @@ class GoogleModel(BaseModel):
                 - confidence (float): Confidence score
         """
         try:
-            # Get access token for authorization
-            access_token = self._get_access_token()
-            if not access_token:
-                return {"error": "Failed to get access token", "text": ""}
+            if self.client is None:
+                self.client = self._create_client()
             
             # Detect audio format and sample rate
             encoding, sample_rate_hertz = self._detect_audio_format(audio_path)
             
-            # Read audio file as binary and encode as base64
-            with open(audio_path, 'rb') as audio_file:
-                audio_content = audio_file.read()
-            
-            audio_content_base64 = base64.b64encode(audio_content).decode('utf-8')
-            
-            # Prepare the request body
-            request_body = {
-                "config": {
-                    "encoding": encoding,
-                    "sampleRateHertz": sample_rate_hertz,
-                    "languageCode": self.language_code,
-                    "enableWordTimeOffsets": True,
-                    "enableAutomaticPunctuation": True
-                },
-                "audio": {
-                    "content": audio_content_base64
-                }
-            }
-            
-            # Make the API request
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {access_token}"
-            }
-            
-            response = requests.post(
-                "https://speech.googleapis.com/v1/speech:recognize",
-                headers=headers,
-                json=request_body
+            # MP3 is only in the v1p1beta1 API; fail the file clearly instead
+            # of with a bare KeyError from the enum lookup
+            if encoding not in speech.RecognitionConfig.AudioEncoding.__members__:
+                return {"text": "", "error": f"{encoding} audio is not supported by the Google Speech v1 API"}
+            
+            config = speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding[encoding],
+                sample_rate_hertz=sample_rate_hertz,
+                language_code=self.language_code,
+                enable_word_time_offsets=True,
+                enable_automatic_punctuation=True
             )
             
-            if response.status_code != 200:
-                print(f"Error response ({response.status_code}): {response.text}")
-                return {"error": response.text, "text": ""}
-            
-            response_json = response.json()
-            
-            # Extract transcript text
-            transcript = ""
+            # gRPC carries the raw bytes, so there is no base64 copy. Large
+            # files go through GCS instead of being inlined in the request.
+            if self.gcs_bucket and os.path.getsize(audio_path) > self.inline_max_bytes:
+                response = self._recognize_from_gcs(audio_path, config)
+            else:
+                with open(audio_path, 'rb') as audio_file:
+                    audio = speech.RecognitionAudio(content=audio_file.read())
+                response = self.client.recognize(config=config, audio=audio)
+            
+            # Extract transcript fragments and word timings in one pass
+            transcript_parts = []
+            words = []
             confidence = 0
             
-            if "results" in response_json:
-                for result in response_json["results"]:
-                    if "alternatives" in result and result["alternatives"]:
-                        alt = result["alternatives"][0]
-                        transcript += alt["transcript"] + " "
-                        if "confidence" in alt:
-                            # For overall confidence, we'll just use the confidence of the first result
-                            # A more sophisticated approach would weight by length of each segment
-                            if confidence == 0:
-                                confidence = alt["confidence"]
-            
-            # Extract word timings
-            words = []
-            if "results" in response_json:
-                for result in response_json["results"]:
-                    if "alternatives" in result and result["alternatives"]:
-                        alt = result["alternatives"][0]
-                        if "words" in alt:
-                            for word_info in alt["words"]:
-                                word = {
-                                    "word": word_info["word"],
-                                    "start_time": float(word_info["startTime"].rstrip("s")),
-                                    "end_time": float(word_info["endTime"].rstrip("s"))
-                                }
-                                words.append(word)
+            for result in response.results:
+                if not result.alternatives:
+                    continue
+                alt = result.alternatives[0]
+                transcript_parts.append(alt.transcript)
+                # For overall confidence, we'll just use the confidence of the first result
+                # A more sophisticated approach would weight by length of each segment
+                if confidence == 0 and alt.confidence:
+                    confidence = alt.confidence
+                words.extend({
+                    "word": word_info.word,
+                    "start_time": word_info.start_time.total_seconds(),
+                    "end_time": word_info.end_time.total_seconds()
+                } for word_info in alt.words)
+            
+            transcript = " ".join(transcript_parts)
             
             return {
                 "text": transcript.strip(),
                 "confidence": confidence,
                 "chunks": words,
-                "raw_response": response_json
+                # Same shape as the REST JSON the model used to return:
+                # camelCase keys, "1.500s" durations, defaults omitted
+                "raw_response": MessageToDict(type(response).pb(response))
             }
             
         except Exception as e:
@@ -1,40 +1,146 @@
 import os
+import json
 import time
+import base64
+import hashlib
+import hmac
+import logging
+import random
+import threading
+import boto3
 import requests
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from models.base_model import BaseModel
 
+logger = logging.getLogger(__name__)
+
+# Webhooks with timestamps further than this from now are rejected as replays
+_WEBHOOK_TOLERANCE = 300  # seconds
+
+def _verify_webhook_signature(secret, headers, body):
+    """
+    Check a Salad webhook against its signing secret. Salad signs deliveries
+    per the Standard Webhooks spec: an HMAC-SHA256 over "<id>.<timestamp>.<body>",
+    sent base64-encoded as "v1,<signature>" (possibly several, space-separated).
+    """
+    webhook_id = headers.get('webhook-id')
+    timestamp = headers.get('webhook-timestamp')
+    signatures = headers.get('webhook-signature')
+    if not (webhook_id and timestamp and signatures):
+        return False
+    try:
+        if abs(time.time() - int(timestamp)) > _WEBHOOK_TOLERANCE:
+            return False
+        key = base64.b64decode(secret.removeprefix('whsec_'))
+    except ValueError:
+        return False
+    
+    signed = f"{webhook_id}.{timestamp}.".encode('utf-8') + body
+    expected = base64.b64encode(hmac.new(key, signed, hashlib.sha256).digest()).decode('ascii')
+    return any(
+        hmac.compare_digest(signature.split(',', 1)[-1], expected)
+        for signature in signatures.split()
+    )
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Receives Salad job-completion webhooks and hands them to the model."""
+    
+    def do_POST(self):
+        try:
+            raw = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            if not _verify_webhook_signature(self.server.model.webhook_secret, self.headers, raw):
+                self.send_response(401)
+                self.end_headers()
+                return
+            body = json.loads(raw)
+            job = body.get('data', body)
+            self.server.model._deliver_webhook(job.get('id'), job)
+            self.send_response(200)
+        except (ValueError, AttributeError):
+            self.send_response(400)
+        self.end_headers()
+    
+    def log_message(self, format, *args):
+        pass
+
 class SaladModel(BaseModel):
     """Salad API speech-to-text implementation."""
     
+    accepts_s3_uri = True
+    
     def __init__(self, config):
         super().__init__(config)
         self.name = "salad"
         self.api_key = os.environ.get('SALAD_API_KEY', config.get('api_key'))
         self.organization = config.get('organization', 'nurix-ai')
+        self.job_timeout = config.get('job_timeout', 300)  # seconds
+        self.poll_initial_delay = config.get('poll_initial_delay', 0.5)
+        self.poll_max_delay = config.get('poll_max_delay', 15.0)
+        self.timeout = (5, 30)  # (connect, read) seconds
+        self.presigned_url_expiry = config.get('presigned_url_expiry', 3600)  # seconds
+        self.session = None
+        self.s3_client = None
+        # When set, Salad POSTs finished jobs to this public URL, which must
+        # route to webhook_host:webhook_port on this machine. Jobs are polled
+        # either way; a webhook only ends the wait early.
+        self.webhook_url = config.get('webhook_url')
+        self.webhook_host = config.get('webhook_host', '127.0.0.1')
+        self.webhook_port = config.get('webhook_port', 8080)
+        self.webhook_secret = os.environ.get('SALAD_WEBHOOK_SECRET', config.get('webhook_secret'))
+        self._webhook_server = None
+        # Jobs currently being waited on; deliveries for other ids are dropped
+        self._waiting_jobs = set()
+        self._webhook_results = {}
+        self._webhook_cond = threading.Condition()
     
     def load(self):
         """Initialize Salad API."""
         if not self.api_key:
             raise ValueError("Salad API key is required. Set it in config or SALAD_API_KEY environment variable.")
         
+        # One keep-alive session for all submits and polls, so each request
+        # reuses a pooled TLS connection instead of opening a new one
+        self.session = requests.Session()
+        retries = Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+        self.session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=retries))
+        self.session.headers.update({"Salad-Api-Key": self.api_key})
+        self.s3_client = boto3.client('s3')
+        
+        if self.webhook_url:
+            if not self.webhook_secret:
+                raise ValueError("Salad webhook secret is required with webhook_url. Set it in config or SALAD_WEBHOOK_SECRET environment variable.")
+            self._webhook_server = ThreadingHTTPServer((self.webhook_host, self.webhook_port), _WebhookHandler)
+            self._webhook_server.model = self
+            threading.Thread(target=self._webhook_server.serve_forever, daemon=True).start()
+            print(f"Listening for Salad webhooks on {self.webhook_host}:{self.webhook_port}")
+        
         print(f"Salad API initialized for organization {self.organization}")
     
-    def _get_presigned_url(self, audio_path):
+    def _get_presigned_url(self, audio_path, bucket_name=None, audio_key=None):
         """
-        For production use, you would upload the file to S3 and generate a presigned URL.
-        This is a simplified version that assumes the file is already accessible via URL.
+        Get a URL that the Salad servers can fetch the audio from.
+        
+        For audio already in S3 this is a presigned GET URL, so Salad pulls the
+        object directly and nothing is downloaded or re-uploaded locally.
         
         Parameters:
             audio_path (str): Path to the audio file
+            bucket_name (str, optional): S3 bucket name if file is already in S3
+            audio_key (str, optional): S3 key if file is already in S3
             
         Returns:
             str: URL to the audio file
         """
-        # In a real implementation, you would use boto3 to upload to S3 and generate a presigned URL
-        # For this example, let's assume the file is local and we need to handle it differently
-        # You would replace this with your actual S3 upload logic
+        if bucket_name and audio_key:
+            return self.s3_client.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': bucket_name, 'Key': audio_key},
+                ExpiresIn=self.presigned_url_expiry
+            )
         
-        # For demonstration purposes only:
+        # Local files are not reachable by Salad; this only works for testing
         return f"file://{os.path.abspath(audio_path)}"
     
     def _submit_transcription_job(self, audio_url, audio_file_id):
@@ -50,11 +156,6 @@ class SaladModel(BaseModel):
         """
         url = f"https://api.salad.com/api/public/organizations/{self.organization}/inference-endpoints/transcribe/jobs"
         
-        headers = {
-            "Salad-Api-Key": self.api_key,
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "input": {
                 "url": audio_url,
@@ -72,8 +173,10 @@ class SaladModel(BaseModel):
                 "audio_file_id": audio_file_id
             }
         }
+        if self.webhook_url:
+            payload["webhook"] = self.webhook_url
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = self.session.post(url, json=payload, timeout=self.timeout)
         
         if response.status_code != 200:
             print(f"API error: Status code {response.status_code}")
@@ -94,11 +197,7 @@ class SaladModel(BaseModel):
         """
         url = f"https://api.salad.com/api/public/organizations/{self.organization}/inference-endpoints/transcribe/jobs/{job_id}"
         
-        headers = {
-            "Salad-Api-Key": self.api_key
-        }
-        
-        response = requests.get(url, headers=headers)
+        response = self.session.get(url, timeout=self.timeout)
         
         if response.status_code != 200:
             print(f"API error checking status: Status code {response.status_code}")
@@ -107,12 +206,90 @@ class SaladModel(BaseModel):
         
         return response.json()
     
-    def transcribe(self, audio_path):
+    def _deliver_webhook(self, job_id, job_status):
+        """Record a job's final state from the webhook and wake its waiter."""
+        if not job_id:
+            raise ValueError("Webhook payload has no job id")
+        with self._webhook_cond:
+            if job_id in self._waiting_jobs:
+                self._webhook_results[job_id] = job_status
+                self._webhook_cond.notify_all()
+    
+    def _wait_for_webhook(self, job_id, timeout):
+        """
+        Block until the webhook for a job arrives or timeout expires.
+        
+        Parameters:
+            job_id (str): Job ID from the submission response
+            timeout (float): Seconds to wait
+            
+        Returns:
+            dict: The delivered job state, or None if none arrived in time
+        """
+        with self._webhook_cond:
+            delivered = self._webhook_cond.wait_for(
+                lambda: job_id in self._webhook_results, timeout=timeout
+            )
+            return self._webhook_results.pop(job_id) if delivered else None
+    
+    def _poll_job(self, job_id):
+        """
+        Poll a job with jittered, capped exponential backoff until it finishes.
+        With a webhook configured, each backoff delay is spent waiting for the
+        webhook instead of sleeping, so a delivery ends the wait early and an
+        unreachable webhook costs nothing over plain polling.
+        
+        Parameters:
+            job_id (str): Job ID from the submission response
+            
+        Returns:
+            dict: The last job state seen, or None if the status could never be read
+        """
+        delay = self.poll_initial_delay
+        deadline = time.monotonic() + self.job_timeout
+        job_status = None
+        if self.webhook_url:
+            with self._webhook_cond:
+                self._waiting_jobs.add(job_id)
+        try:
+            while True:
+                latest = self._get_job_status(job_id)
+                
+                if latest:
+                    job_status = latest
+                    status = job_status.get('status', '').lower()
+                    if status in ['succeeded', 'completed', 'failed', 'error']:
+                        return job_status
+                    
+                    logger.debug("Job %s status: %s, waiting...", job_id, status)
+                
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return job_status
+                
+                wait = min(delay * random.uniform(0.8, 1.2), remaining)
+                if self.webhook_url:
+                    delivered = self._wait_for_webhook(job_id, wait)
+                    if delivered is not None:
+                        logger.debug("Webhook received for job %s", job_id)
+                        return delivered
+                else:
+                    time.sleep(wait)
+                delay = min(delay * 1.6, self.poll_max_delay)
+        finally:
+            if self.webhook_url:
+                with self._webhook_cond:
+                    self._waiting_jobs.discard(job_id)
+                    self._webhook_results.pop(job_id, None)
+    
+    def transcribe(self, audio_path, bucket_name=None, audio_key=None):
         """
         Transcribe the audio file using Salad API.
         
         Args:
             audio_path (str): Path to the audio file
+            bucket_name (str, optional): S3 bucket name if file is already in S3
+            audio_key (str, optional): S3 key if file is already in S3
             
         Returns:
             dict: Dictionary containing:
@@ -124,8 +301,7 @@ class SaladModel(BaseModel):
             audio_file_id = os.path.splitext(os.path.basename(audio_path))[0]
             
             # Get a URL for the audio file
-            # In a real implementation, you would upload to S3 and generate a presigned URL
-            audio_url = self._get_presigned_url(audio_path)
+            audio_url = self._get_presigned_url(audio_path, bucket_name, audio_key)
             
             # Submit transcription job
             job_response = self._submit_transcription_job(audio_url, audio_file_id)
@@ -134,31 +310,20 @@ class SaladModel(BaseModel):
                 return {'text': '', 'error': 'Failed to submit transcription job'}
             
             job_id = job_response['id']
-            print(f"Submitted job {job_id} for {audio_file_id}, waiting for completion...")
+            logger.debug("Submitted job %s for %s, waiting for completion...", job_id, audio_file_id)
             
-            # Poll for job completion
-            max_retries = 60  # 5 minutes at 5-second intervals
-            for retry in range(max_retries):
-                job_status = self._get_job_status(job_id)
-                
-                if not job_status:
-                    time.sleep(5)
-                    continue
-                
-                status = job_status.get('status', '').lower()
-                
-                if status in ['succeeded', 'completed']:
-                    print(f"Job {job_id} completed!")
-                    break
-                elif status in ['failed', 'error']:
-                    error_message = job_status.get('error', 'Unknown error')
-                    return {'text': '', 'error': f"Job failed: {error_message}"}
-                
-                print(f"Job status: {status}, waiting...")
-                time.sleep(5)
-            else:
+            # Poll until the job finishes; a webhook delivery ends the wait early
+            job_status = self._poll_job(job_id)
+            
+            status = job_status.get('status', '').lower() if job_status else ''
+            if status in ['failed', 'error']:
+                error_message = job_status.get('error', 'Unknown error')
+                return {'text': '', 'error': f"Job failed: {error_message}"}
+            elif status not in ['succeeded', 'completed']:
                 return {'text': '', 'error': 'Job timed out'}
             
+            logger.debug("Job %s completed", job_id)
+            
             # Extract transcript from job output
             text = job_status.get('text', '')
             
@@ -1,10 +1,25 @@
+import io
 import os
+import numpy as np
+import soundfile as sf
 import torch
 from models.base_model import BaseModel
-from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, pipeline
+from utils import audio_digest
+from transformers import AutoModelForSpeechSeq2Seq, AutoProcessor, BitsAndBytesConfig, pipeline
+
+try:
+    import librosa
+except ImportError:  # the pipeline resamples itself, just more slowly
+    librosa = None
+
+# 'hf' runs the transformers pipeline, 'bnb-int8' the same pipeline with
+# bitsandbytes int8 weights, and 'faster-whisper' the CTranslate2 runtime
+BACKENDS = ('hf', 'bnb-int8', 'faster-whisper')
 
 class WhisperModel(BaseModel):
-    """Whisper model implementation using HuggingFace transformers."""
+    """Whisper model implementation using HuggingFace transformers or faster-whisper."""
+    
+    accepts_bytes = True
     
     def __init__(self, config):
         super().__init__(config)
@@ -13,6 +28,12 @@ class WhisperModel(BaseModel):
         self.processor = None
         self.pipe = None
         self.model_id = config.get('model_id', 'openai/whisper-large-v3-turbo')
+        self.backend = config.get('backend', 'hf')
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown Whisper backend: {self.backend}. Available backends: {', '.join(BACKENDS)}")
+        # faster-whisper needs a CTranslate2 conversion of the model
+        self.faster_whisper_model_id = config.get('faster_whisper_model_id', 'large-v3-turbo')
+        self.sampling_rate = 16000
         
         # Determine device
         if config.get('device'):
@@ -26,45 +47,174 @@ class WhisperModel(BaseModel):
             else:
                 self.device = "cpu"
         
-        self.torch_dtype = torch.float16 if self.device == "cuda" else torch.float32
-        self.batch_size = config.get('batch_size', 1)
+        # bfloat16 on Ampere and newer: same speed as float16 without the overflow risk
+        if self.device == "cuda":
+            self.torch_dtype = torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16
+        else:
+            self.torch_dtype = torch.float32
+        self.attn_implementation = config.get('attn_implementation', 'sdpa')
+        self.torch_compile = config.get('torch_compile', True)
+        # Optional cache of decoded, resampled audio for repeated evaluations
+        self.audio_cache_dir = config.get('audio_cache_dir')
+        # Files per pipeline call; batching keeps the GPU busy across short clips.
+        # faster-whisper transcribes one file per call.
+        if self.backend == 'faster-whisper':
+            self.batch_size = 1
+        else:
+            self.batch_size = config.get('batch_size') or (8 if self.device == "cuda" else 1)
+        self.compute_type = config.get('compute_type') or ("int8_float16" if self.device == "cuda" else "int8")
         self.language = config.get('language', 'en')
     
     def load(self):
-        """Load the Whisper model from HuggingFace."""
-        print(f"Loading Whisper model '{self.model_id}' on {self.device}...")
+        """Load the Whisper model for the configured backend."""
+        if self.backend == 'faster-whisper':
+            self._load_faster_whisper()
+            return
         
-        self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
-            self.model_id,
-            torch_dtype=self.torch_dtype,
-            use_safetensors=True
-        )
-        self.model.to(self.device)
+        print(f"Loading Whisper model '{self.model_id}' on {self.device} ({self.backend})...")
+        
+        if self.backend == 'bnb-int8':
+            # accelerate places the quantized weights; they can't be moved afterwards
+            self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                self.model_id,
+                torch_dtype=torch.float16,
+                use_safetensors=True,
+                attn_implementation=self.attn_implementation,
+                quantization_config=BitsAndBytesConfig(load_in_8bit=True),
+                device_map="auto"
+            )
+        else:
+            self.model = AutoModelForSpeechSeq2Seq.from_pretrained(
+                self.model_id,
+                torch_dtype=self.torch_dtype,
+                use_safetensors=True,
+                attn_implementation=self.attn_implementation
+            )
+            self.model.to(self.device)
+        
+        # Compile the forward pass on CUDA; the static KV cache keeps decode
+        # shapes fixed so the compiled graph is reused across steps
+        compiled = self.torch_compile and self.device == "cuda" and self.backend == 'hf'
+        if compiled:
+            self.model.generation_config.cache_implementation = "static"
+            self.model.forward = torch.compile(self.model.forward, mode="reduce-overhead", fullgraph=False)
         
         self.processor = AutoProcessor.from_pretrained(self.model_id)
+        self.sampling_rate = self.processor.feature_extractor.sampling_rate
         
         generate_kwargs = {"language": self.language}
+        # A device_map-loaded model is already placed
+        device_kwargs = {} if self.backend == 'bnb-int8' else {"device": self.device}
         self.pipe = pipeline(
             "automatic-speech-recognition",
             model=self.model,
             tokenizer=self.processor.tokenizer,
             feature_extractor=self.processor.feature_extractor,
-            torch_dtype=self.torch_dtype,
-            device=self.device,
+            torch_dtype=self.model.dtype,
             chunk_length_s=30,
             batch_size=self.batch_size,
             generate_kwargs=generate_kwargs,
-            return_timestamps="word"
+            return_timestamps="word",
+            **device_kwargs
         )
         
+        if compiled:
+            self._warmup()
+        
+        print("Whisper model loaded successfully.")
+    
+    def _load_faster_whisper(self):
+        """Load the CTranslate2 model with faster-whisper."""
+        from faster_whisper import WhisperModel as FasterWhisperModel
+        
+        # CTranslate2 runs on CUDA or CPU only
+        device = "cuda" if self.device == "cuda" else "cpu"
+        print(f"Loading faster-whisper model '{self.faster_whisper_model_id}' on {device} ({self.compute_type})...")
+        self.model = FasterWhisperModel(self.faster_whisper_model_id, device=device, compute_type=self.compute_type)
         print("Whisper model loaded successfully.")
     
+    def _warmup(self):
+        """Run one silent 30s window so compilation happens before timing starts."""
+        print("Warming up compiled Whisper model...")
+        silence = np.zeros(30 * self.sampling_rate, dtype=np.float32)
+        self.pipe({"raw": silence, "sampling_rate": self.sampling_rate})
+    
+    def _decode(self, audio):
+        """
+        Decode a path or encoded file bytes to mono float32 samples,
+        resampled to the feature extractor's rate when librosa is available.
+        
+        Returns:
+            tuple: (samples, sampling_rate)
+        """
+        target_rate = self.sampling_rate
+        
+        cache_path = None
+        if self.audio_cache_dir:
+            cache_path = os.path.join(self.audio_cache_dir, f"{audio_digest(audio)}-{target_rate}.npy")
+            if os.path.exists(cache_path):
+                return np.load(cache_path), target_rate
+        
+        source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+        array, sampling_rate = sf.read(source, dtype='float32')
+        if array.ndim > 1:
+            array = array.mean(axis=1)
+        if sampling_rate != target_rate and librosa is not None:
+            array = librosa.resample(array, orig_sr=sampling_rate, target_sr=target_rate)
+            sampling_rate = target_rate
+        
+        if cache_path and sampling_rate == target_rate:
+            os.makedirs(self.audio_cache_dir, exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp.npy"
+            np.save(tmp_path, array)
+            os.replace(tmp_path, cache_path)
+        return array, sampling_rate
+    
+    def _prepare_input(self, audio):
+        """
+        Convert audio into the pipeline's raw-array input, so the pipeline
+        skips its own (ffmpeg-based) file loading. Formats libsndfile can't
+        read (e.g. MP3 before libsndfile 1.1) are handed to the pipeline as is.
+        
+        Args:
+            audio (str, bytes, or np.ndarray): Path, encoded audio file bytes,
+                or mono samples at the feature extractor's sampling rate
+        """
+        if isinstance(audio, np.ndarray):
+            return {"raw": audio, "sampling_rate": self.sampling_rate}
+        try:
+            array, sampling_rate = self._decode(audio)
+        except RuntimeError:  # soundfile.LibsndfileError
+            return audio
+        return {"raw": array, "sampling_rate": sampling_rate}
+    
+    def _format_result(self, result):
+        """Convert a pipeline output into the standard result dictionary."""
+        # Extract transcript text
+        transcript = result.get('text', '')
+        
+        # Format word timestamps if they exist
+        chunks = []
+        if 'chunks' in result:
+            for chunk in result['chunks']:
+                chunks.append({
+                    'word': chunk.get('text', ''),
+                    'start_time': chunk.get('timestamp', [0, 0])[0],
+                    'end_time': chunk.get('timestamp', [0, 0])[1]
+                })
+        
+        return {
+            'text': transcript,
+            'chunks': chunks
+        }
+    
     def transcribe(self, audio_path):
         """
         Transcribe the audio file using Whisper.
         
         Args:
-            audio_path (str): Path to the audio file
+            audio_path (str, bytes, or np.ndarray): Path to the audio file, the
+                encoded file contents, or decoded mono samples
             
         Returns:
             dict: Dictionary containing:
@@ -72,25 +222,85 @@ class WhisperModel(BaseModel):
                 - chunks (list): Word-level information with timing
         """
         try:
-            result = self.pipe(audio_path)
-            
-            # Extract transcript text
-            transcript = result.get('text', '')
-            
-            # Format word timestamps if they exist
-            chunks = []
-            if 'chunks' in result:
-                for chunk in result['chunks']:
-                    chunks.append({
-                        'word': chunk.get('text', ''),
-                        'start_time': chunk.get('timestamp', [0, 0])[0],
-                        'end_time': chunk.get('timestamp', [0, 0])[1]
-                    })
-            
-            return {
-                'text': transcript,
-                'chunks': chunks
-            }
+            if self.backend == 'faster-whisper':
+                return self._transcribe_faster_whisper(audio_path)
+            return self._format_result(self.pipe(self._prepare_input(audio_path)))
         except Exception as e:
-            print(f"Error transcribing {audio_path}: {e}")
-            return {'text': '', 'error': str(e)}
\ No newline at end of file
+            source = audio_path if isinstance(audio_path, str) else "in-memory audio"
+            print(f"Error transcribing {source}: {e}")
+            return {'text': '', 'error': str(e)}
+    
+    def _transcribe_faster_whisper(self, audio):
+        """Transcribe with faster-whisper, mapping its words onto the chunks schema."""
+        if isinstance(audio, np.ndarray):
+            samples = audio
+        else:
+            try:
+                samples, sampling_rate = self._decode(audio)
+            except RuntimeError:  # soundfile.LibsndfileError
+                samples, sampling_rate = None, None
+            if sampling_rate != self.sampling_rate:
+                # Unreadable by libsndfile, or no librosa; let faster-whisper
+                # decode and resample with PyAV
+                from faster_whisper import decode_audio
+                source = io.BytesIO(audio) if isinstance(audio, (bytes, bytearray)) else audio
+                samples = decode_audio(source, sampling_rate=self.sampling_rate)
+        
+        segments, _ = self.model.transcribe(samples, language=self.language, word_timestamps=True)
+        
+        text_parts = []
+        chunks = []
+        for segment in segments:
+            text_parts.append(segment.text)
+            for word in segment.words or []:
+                chunks.append({
+                    'word': word.word,
+                    'start_time': word.start,
+                    'end_time': word.end
+                })
+        
+        return {
+            'text': ''.join(text_parts).strip(),
+            'chunks': chunks
+        }
+    
+    def transcribe_many(self, audio_paths):
+        """
+        Transcribe several audio files in one batched pipeline call. Inputs
+        that fail to decode get an error result; the rest are still transcribed.
+        
+        Args:
+            audio_paths (list): Paths, encoded file contents, or decoded samples,
+                as accepted by transcribe()
+            
+        Returns:
+            list: One result dictionary per input, in the same format as transcribe()
+        """
+        if self.backend == 'faster-whisper':
+            return [self.transcribe(audio) for audio in audio_paths]
+        results = [None] * len(audio_paths)
+        inputs = []
+        decoded = []
+        for i, audio in enumerate(audio_paths):
+            try:
+                inputs.append(self._prepare_input(audio))
+                decoded.append(i)
+            except Exception as e:
+                source = audio if isinstance(audio, str) else "in-memory audio"
+                print(f"Error decoding {source}: {e}")
+                results[i] = {'text': '', 'error': str(e)}
+        
+        if decoded:
+            try:
+                outputs = self.pipe(inputs, batch_size=self.batch_size)
+                for i, output in zip(decoded, outputs):
+                    results[i] = self._format_result(output)
+            except Exception as e:
+                # Retry one by one so the error stays with the file that caused it
+                print(f"Error transcribing batch of {len(decoded)} files, retrying individually: {e}")
+                for i, pipeline_input in zip(decoded, inputs):
+                    try:
+                        results[i] = self._format_result(self.pipe(pipeline_input))
+                    except Exception as file_error:
+                        results[i] = {'text': '', 'error': str(file_error)}
+        return results
\ No newline at end of file
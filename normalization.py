@@ -0,0 +1,27 @@
+"""
+Transcript normalization shared by transcribe.py (via utils) and evaluate.py,
+so both score the same hypothesis identically.
+"""
+
+import unicodedata
+
+# Recorded in metric summaries. Scores produced before punctuation was
+# stripped (plain lowercasing) are not comparable with these.
+NORMALIZATION = 'lowercase, punctuation removed, whitespace collapsed'
+
+class _PunctuationTable(dict):
+    """str.translate table that drops Unicode punctuation (category P*), filled lazily."""
+    
+    def __missing__(self, codepoint):
+        value = None if unicodedata.category(chr(codepoint)).startswith('P') else codepoint
+        self[codepoint] = value
+        return value
+
+_PUNCTUATION = _PunctuationTable()
+
+def normalize_transcript(text):
+    """
+    Lowercase text, remove punctuation and collapse whitespace, matching
+    jiwer's ToLowerCase, RemovePunctuation, RemoveMultipleSpaces and Strip.
+    """
+    return ' '.join(text.lower().translate(_PUNCTUATION).split())
@@ -7,23 +7,37 @@ various STT engines (Dolphin, Whisper, Google, AWS, Salad, Deepgram).
 It handles downloading audio from S3, transcription, and evaluation.
 """
 
+import io
 import os
 import argparse
 import tempfile
 import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from tqdm import tqdm
 
 from config import S3_CONFIG, MODEL_CONFIGS, OUTPUT_CONFIG, AVAILABLE_MODELS, API_KEYS
 from utils import (
     list_files_in_s3, 
     download_file_from_s3, 
+    download_file_bytes,
     build_transcript_dict, 
     get_audio_duration, 
-    save_result,
+    get_s3_audio_info,
+    ResultWriter,
+    transcription_cache_path,
+    load_cached_result,
+    store_cached_result,
+    transcribe_cached,
     prepare_output_dir,
     calculate_metrics
 )
 from models.model_factory import get_model
+from normalization import NORMALIZATION
+
+logger = logging.getLogger(__name__)
 
 def process_dataset(model, bucket_name, prefix, output_dir, test_set):
     """
@@ -64,59 +78,217 @@ def process_dataset(model, bucket_name, prefix, output_dir, test_set):
         csvfile.write('file_id,ground_truth,hypothesis,wer,cer\n')
     
     # Use a temporary directory for downloaded files
-    with tempfile.TemporaryDirectory() as tmpdir:
+    with tempfile.TemporaryDirectory() as tmpdir, \
+            ResultWriter(test_output_dir, OUTPUT_CONFIG.get('pretty_json', False)) as writer:
         print(f"Created temporary directory '{tmpdir}' for downloading files.")
         
         # Build the transcript dictionary
         print("Building transcript dictionary...")
-        transcript_dict = build_transcript_dict(bucket_name, transcript_files, tmpdir)
+        transcript_dict = build_transcript_dict(bucket_name, transcript_files)
         
         # Initialize metrics
         total_duration = 0.0
         results = []
         
-        # Process each audio file
-        for audio_file_key in tqdm(audio_files, desc=f"Processing {test_set}"):
-            if total_duration >= OUTPUT_CONFIG['max_audio_duration']:
-                print(f"Reached maximum audio duration ({OUTPUT_CONFIG['max_audio_duration']} seconds). Stopping.")
-                break
-            
-            # Get file ID (basename without extension)
+        # Skip files we don't have a ground truth for
+        pending = []
+        for audio_file_key in audio_files:
             file_id = os.path.splitext(os.path.basename(audio_file_key))[0]
-            
-            # Skip if we don't have a ground truth for this file
             if file_id not in transcript_dict:
                 print(f"No ground truth found for {file_id}, skipping.")
                 continue
+            pending.append((file_id, audio_file_key))
+        
+        stop_event = threading.Event()
+        cache_dir = OUTPUT_CONFIG.get('cache_dir') if OUTPUT_CONFIG.get('use_cache', True) else None
+        
+        def _fetch_audio(audio_file_key):
+            # Models that read S3 themselves only need the duration, taken from
+            # the object's header; the S3 URI and ETag stand in for the audio
+            # as its cache identity
+            if model.accepts_s3_uri:
+                duration, etag = get_s3_audio_info(bucket_name, audio_file_key)
+                return f"s3://{bucket_name}/{audio_file_key}#{etag}".encode(), duration
+            # Models that take bytes never need the audio on disk
+            if model.accepts_bytes:
+                audio_bytes = download_file_bytes(bucket_name, audio_file_key)
+                return audio_bytes, get_audio_duration(io.BytesIO(audio_bytes))
+            local_audio_path = download_file_from_s3(bucket_name, audio_file_key, tmpdir)
+            return local_audio_path, get_audio_duration(local_audio_path)
+        
+        def _transcribe_one(audio_file_key, audio):
+            if model.accepts_s3_uri:
+                return model.transcribe(audio_file_key, bucket_name=bucket_name, audio_key=audio_file_key)
+            return model.transcribe(audio)
+        
+        def _transcribe_batch(batch, audios):
+            # Only send cache misses to the model, still as one batched call
+            batch_results = [None] * len(batch)
+            cache_paths = [None] * len(batch)
+            if cache_dir:
+                for i, audio in enumerate(audios):
+                    cache_paths[i] = transcription_cache_path(cache_dir, model, audio)
+                    batch_results[i] = load_cached_result(cache_paths[i])
             
-            try:
-                # Download the audio file
-                local_audio_path = download_file_from_s3(bucket_name, audio_file_key, tmpdir)
-                
-                # Get audio duration
-                duration = get_audio_duration(local_audio_path)
-                total_duration += duration
-                
-                # Get ground truth
-                ground_truth = transcript_dict[file_id]
-                
-                # Transcribe using the model
-                print(f"Transcribing {file_id}...")
-                result = model.transcribe(local_audio_path)
-                
-                # Save result with ground truth
-                save_result(test_output_dir, file_id, result, ground_truth)
+            misses = [i for i, result in enumerate(batch_results) if result is None]
+            if misses:
+                fresh = model.transcribe_many([audios[i] for i in misses])
+                for i, result in zip(misses, fresh):
+                    batch_results[i] = result
+                    if cache_dir:
+                        store_cached_result(cache_paths[i], result)
+            return batch_results
+        
+        def _fetch_batch(batch):
+            # Download the audio files and get their durations; a failed
+            # download only affects its own file
+            if stop_event.is_set():
+                return None
+            fetched = []
+            for _, audio_file_key in batch:
+                try:
+                    fetched.append(_fetch_audio(audio_file_key) + (None,))
+                except Exception as e:
+                    fetched.append((None, 0.0, e))
+            return fetched
+        
+        def _process_batch(batch, fetch_future):
+            # Don't start new files once the duration limit has been hit
+            if stop_event.is_set():
+                return []
+            
+            # Usually already downloaded while earlier batches were transcribing
+            fetched = fetch_future.result()
+            if fetched is None:
+                return []
+            
+            results_by_index = {}
+            ok = []
+            for i, (audio, _, error) in enumerate(fetched):
+                if error is None:
+                    ok.append(i)
+                else:
+                    results_by_index[i] = {'text': '', 'error': f"Download failed: {error}"}
+            
+            # Transcribe using the model, in a single call for batched models
+            logger.debug("Transcribing %s...", ', '.join(batch[i][0] for i in ok))
+            if len(ok) > 1:
+                batch_results = _transcribe_batch([batch[i] for i in ok], [fetched[i][0] for i in ok])
+            elif ok:
+                audio_file_key = batch[ok[0]][1]
+                batch_results = [transcribe_cached(
+                    model, fetched[ok[0]][0], cache_dir,
+                    lambda audio: _transcribe_one(audio_file_key, audio)
+                )]
+            else:
+                batch_results = []
+            results_by_index.update(zip(ok, batch_results))
+            
+            return [(file_id, results_by_index[i], fetched[i][1])
+                    for i, (file_id, _) in enumerate(batch)]
+        
+        # Batched models (Whisper) take windows of batch_size files per call
+        batch_size = getattr(model, 'batch_size', 1)
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        
+        # API-backed models overlap many requests; local models run one at a time
+        concurrency = model.config.get('concurrency', 1)
+        executor = ThreadPoolExecutor(max_workers=concurrency)
+        
+        # Downloads run ahead of transcription by up to prefetch batches, so
+        # S3 round trips overlap with the model instead of preceding it
+        window = concurrency + OUTPUT_CONFIG.get('prefetch_batches', 4)
+        download_executor = ThreadPoolExecutor(max_workers=window)
+        pbar = tqdm(total=len(pending), desc=f"Processing {test_set}")
+        
+        # Scoring (jiwer) and CSV/JSON writes run on a background thread so
+        # they overlap with the next transcriptions
+        write_queue = queue.Queue()
+        
+        def _write_results():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                file_id, result = item
+                try:
+                    writer.write(file_id, result, transcript_dict[file_id])
+                except Exception as e:
+                    pbar.write(f"Error saving {file_id}: {e}")
+                    continue
                 
                 # Track results for metrics calculation
                 if 'wer' in result and 'cer' in result:
                     results.append({
                         'file_id': file_id,
+                        'ground_truth': result['ground_truth'],
+                        'hypothesis': result['text'],
                         'wer': result['wer'],
                         'cer': result['cer']
                     })
-                
+                    pbar.set_postfix_str(f"{file_id} wer={result['wer']:.3f}", refresh=False)
+        
+        result_thread = threading.Thread(target=_write_results, daemon=True)
+        result_thread.start()
+        
+        # Keep at most `window` batches in flight; each completion admits the next
+        futures = {}
+        remaining_batches = iter(batches)
+        
+        def _submit_next():
+            batch = next(remaining_batches, None)
+            if batch is not None:
+                fetch_future = download_executor.submit(_fetch_batch, batch)
+                futures[executor.submit(_process_batch, batch, fetch_future)] = batch
+        
+        for _ in range(window):
+            _submit_next()
+        
+        def _collect(future, batch):
+            # Queue a finished batch's results for writing; returns its audio duration
+            pbar.update(len(batch))
+            try:
+                outcomes = future.result()
             except Exception as e:
-                print(f"Error processing {file_id}: {e}")
+                for file_id, _ in batch:
+                    pbar.write(f"Error processing {file_id}: {e}")
+                return 0.0
+            
+            batch_duration = 0.0
+            for file_id, result, duration in outcomes:
+                if 'error' in result:
+                    pbar.write(f"Error processing {file_id}: {result['error']}")
+                batch_duration += duration
+                write_queue.put((file_id, result))
+            return batch_duration
+        
+        try:
+            while futures and not stop_event.is_set():
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch = futures.pop(future)
+                    if not stop_event.is_set():
+                        _submit_next()
+                    total_duration += _collect(future, batch)
+                    
+                    if total_duration >= OUTPUT_CONFIG['max_audio_duration'] and not stop_event.is_set():
+                        stop_event.set()
+                        print(f"Reached maximum audio duration ({OUTPUT_CONFIG['max_audio_duration']} seconds). Stopping.")
+        finally:
+            stop_event.set()
+            # Cancel batches that haven't started. Running ones are finished
+            # and still saved, since their transcriptions are already paid for.
+            for future in list(futures):
+                if future.cancel():
+                    del futures[future]
+            for future in wait(futures).done:
+                total_duration += _collect(future, futures.pop(future))
+            executor.shutdown(wait=True)
+            download_executor.shutdown(wait=True, cancel_futures=True)
+            # Let the writer drain before metrics are aggregated
+            write_queue.put(None)
+            result_thread.join()
+            pbar.close()
         
         # Calculate and save metrics
         metrics = calculate_metrics(results)
@@ -129,20 +301,27 @@ def process_dataset(model, bucket_name, prefix, output_dir, test_set):
                 'model': model.name,
                 'num_files': metrics['num_files'],
                 'total_duration': total_duration,
+                'wer': metrics['wer'],
+                'cer': metrics['cer'],
                 'avg_wer': metrics['avg_wer'],
-                'avg_cer': metrics['avg_cer']
+                'avg_cer': metrics['avg_cer'],
+                'text_normalization': NORMALIZATION
             }, f, indent=2)
         
         # Print metrics
         print(f"\n{test_set} Results:")
         print(f"Number of files processed: {metrics['num_files']}")
         print(f"Total audio duration: {total_duration:.2f} seconds")
-        print(f"Average WER: {metrics['avg_wer']:.4f}")
-        print(f"Average CER: {metrics['avg_cer']:.4f}")
+        print(f"Corpus WER: {metrics['wer']:.4f}")
+        print(f"Corpus CER: {metrics['cer']:.4f}")
+        print(f"Average per-file WER: {metrics['avg_wer']:.4f}")
+        print(f"Average per-file CER: {metrics['avg_cer']:.4f}")
         
         return {
             'num_files': metrics['num_files'],
             'total_duration': total_duration,
+            'wer': metrics['wer'],
+            'cer': metrics['cer'],
             'avg_wer': metrics['avg_wer'],
             'avg_cer': metrics['avg_cer']
         }
@@ -157,9 +336,16 @@ def main():
                       help=f'Output directory (default: {OUTPUT_CONFIG["base_dir"]})')
     parser.add_argument('--api-key', default=None,
                       help='API key for cloud services (if not set in environment/config)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                      help='Log per-file and per-job progress')
     
     args = parser.parse_args()
     
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.WARNING,
+        format='%(asctime)s %(name)s %(levelname)s: %(message)s'
+    )
+    
     # Set output directory
     output_dir = args.output_dir or OUTPUT_CONFIG['base_dir']
     os.makedirs(output_dir, exist_ok=True)
@@ -222,7 +408,7 @@ def main():
         
         print("\n=== OVERALL RESULTS ===")
         for test_set, metrics in results.items():
-            print(f"{test_set}: WER={metrics['avg_wer']:.4f}, CER={metrics['avg_cer']:.4f}, Files={metrics['num_files']}")
+            print(f"{test_set}: WER={metrics['wer']:.4f}, CER={metrics['cer']:.4f}, Files={metrics['num_files']}")
     
     print(f"\nAll results saved to {output_dir}")
 
@@ -1,34 +1,107 @@
+import io
 import os
 import boto3
 import json
 import csv
-import tempfile
+import hashlib
+import threading
+from functools import lru_cache
 import soundfile as sf
-from jiwer import wer, cer
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+import jiwer
+from jiwer import process_words, process_characters
+from normalization import normalize_transcript
 from tqdm import tqdm
 
-def list_files_in_s3(bucket_name, prefix, extensions):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Large audio objects are fetched as parallel ranged GETs
+_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=8,
+    use_threads=True
+)
+
+class _NormalizeTranscript(jiwer.AbstractTransform):
+    """jiwer transform wrapping normalize_transcript, shared with evaluate.py."""
+    
+    def process_string(self, s):
+        return normalize_transcript(s)
+
+# Shared text normalization for per-file and corpus-level scoring
+WER_TRANSFORM = jiwer.Compose([_NormalizeTranscript(), jiwer.ReduceToListOfListOfWords()])
+CER_TRANSFORM = jiwer.Compose([_NormalizeTranscript(), jiwer.ReduceToListOfListOfChars()])
+
+def _dumps(obj, indent=False):
+    """Serialize obj to UTF-8 JSON bytes, with orjson when it is installed."""
+    if orjson:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(obj, option=option)
+    return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None).encode('utf-8')
+
+@lru_cache(maxsize=1)
+def _get_s3():
+    """
+    Shared S3 client. Creating a client loads the service model and resolves
+    credentials, so it is built once; clients are thread-safe to share.
+    """
+    return boto3.client('s3', config=Config(
+        max_pool_connections=64,
+        retries={'max_attempts': 10, 'mode': 'adaptive'}
+    ))
+
+def _matching_keys(contents, extensions):
+    # Most keys already use lowercase extensions, so only lowercase on a miss
+    return [
+        obj['Key'] for obj in contents
+        if obj['Key'].endswith(extensions) or obj['Key'].lower().endswith(extensions)
+    ]
+
+def _list_prefix(s3, bucket_name, prefix, extensions):
+    paginator = s3.get_paginator('list_objects_v2')
+    files = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix,
+                                   PaginationConfig={'PageSize': 1000}):
+        files.extend(_matching_keys(page.get('Contents', []), extensions))
+    return files
+
+def list_files_in_s3(bucket_name, prefix, extensions, max_workers=16):
     """
     List all files in the specified S3 bucket and prefix matching the given extensions.
+    Each immediate sub-prefix ("subdirectory") is paginated in its own thread.
 
     Parameters:
         bucket_name (str): Name of the S3 bucket.
         prefix (str): Prefix within the S3 bucket.
         extensions (tuple): File extensions to filter by.
+        max_workers (int): Number of sub-prefixes listed concurrently.
 
     Returns:
-        List[str]: List of S3 object keys for matching files.
+        List[str]: List of S3 object keys for matching files, in key order.
     """
-    s3 = boto3.client('s3')
+    s3 = _get_s3()
+    extensions = tuple(ext.lower() for ext in extensions)
     paginator = s3.get_paginator('list_objects_v2')
+    
+    # One delimited pass collects top-level keys and the sub-prefixes to fan out over
     files = []
-
-    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
-        if 'Contents' in page:
-            for obj in page['Contents']:
-                key = obj['Key']
-                if key.lower().endswith(extensions):
-                    files.append(key)
+    sub_prefixes = []
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix, Delimiter='/',
+                                   PaginationConfig={'PageSize': 1000}):
+        files.extend(_matching_keys(page.get('Contents', []), extensions))
+        sub_prefixes.extend(p['Prefix'] for p in page.get('CommonPrefixes', []))
+    
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for keys in executor.map(lambda p: _list_prefix(s3, bucket_name, p, extensions), sub_prefixes):
+            files.extend(keys)
+    
+    files.sort()
     return files
 
 def download_file_from_s3(bucket_name, object_key, local_dir):
@@ -43,102 +116,339 @@ def download_file_from_s3(bucket_name, object_key, local_dir):
     Returns:
         str: Path to the local file.
     """
-    s3 = boto3.client('s3')
+    s3 = _get_s3()
     local_filename = os.path.basename(object_key)
     local_path = os.path.join(local_dir, local_filename)
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
-    s3.download_file(bucket_name, object_key, local_path)
+    s3.download_file(bucket_name, object_key, local_path, Config=_TRANSFER_CONFIG)
     return local_path
 
-def build_transcript_dict(bucket_name, transcript_keys, tmpdir):
+def download_file_bytes(bucket_name, object_key):
+    """
+    Downloads a file from S3 into memory.
+
+    Parameters:
+        bucket_name (str): Name of the S3 bucket.
+        object_key (str): Key of the S3 object.
+
+    Returns:
+        bytes: Contents of the object.
+    """
+    s3 = _get_s3()
+    buffer = io.BytesIO()
+    s3.download_fileobj(bucket_name, object_key, buffer, Config=_TRANSFER_CONFIG)
+    return buffer.getvalue()
+
+def _read_transcript(s3, bucket_name, transcript_key):
+    """
+    Streams a .trans.txt object from S3 and parses its "<file_id> <TRANSCRIPT>" lines.
+    """
+    entries = {}
+    body = s3.get_object(Bucket=bucket_name, Key=transcript_key)['Body']
+    for line in body.iter_lines():
+        parts = line.decode('utf-8').strip().split(' ', 1)
+        if len(parts) == 2:
+            key, transcript = parts
+            entries[key] = transcript.lower()
+    return entries
+
+def build_transcript_dict(bucket_name, transcript_keys, max_workers=32):
     """
     Downloads and parses transcript files from S3 to build a mapping from audio file IDs to transcripts.
+    Transcript objects are fetched concurrently and parsed straight from the response stream.
     """
+    s3 = _get_s3()
+    
     transcript_dict = {}
-    for transcript_key in transcript_keys:
-        local_transcript_path = download_file_from_s3(bucket_name, transcript_key, tmpdir)
-        with open(local_transcript_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                parts = line.strip().split(' ', 1)
-                if len(parts) == 2:
-                    key, transcript = parts
-                    transcript_dict[key] = transcript.lower()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for entries in executor.map(lambda key: _read_transcript(s3, bucket_name, key), transcript_keys):
+            transcript_dict.update(entries)
     return transcript_dict
 
 def get_audio_duration(audio_path):
     """
     Get the duration of an audio file in seconds.
+
+    Parameters:
+        audio_path (str or file-like): Path to the audio file, or an open binary stream.
     """
-    with sf.SoundFile(audio_path) as f:
-        duration = len(f) / f.samplerate
-    return duration
+    # Header metadata only; no decoder is set up for the audio stream
+    info = sf.info(audio_path)
+    return info.frames / info.samplerate
 
-def save_result(output_dir, file_id, result, ground_truth=None):
+class _S3RangeReader(io.RawIOBase):
     """
-    Save transcription result as JSON and update CSV.
+    Seekable, read-only view of an S3 object that fetches byte ranges on
+    demand, so soundfile can read a header without downloading the audio.
+    """
+    
+    def __init__(self, s3, bucket_name, object_key, block_size=64 * 1024):
+        self._s3 = s3
+        self._bucket_name = bucket_name
+        self._object_key = object_key
+        self._block_size = block_size
+        head = s3.get_object(Bucket=bucket_name, Key=object_key, Range=f"bytes=0-{block_size - 1}")
+        self.etag = head['ETag']
+        self.size = int(head['ContentRange'].rsplit('/', 1)[1])
+        self._blocks = {0: head['Body'].read()}
+        self._pos = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        self._pos = max(offset, 0)
+        return self._pos
+    
+    def tell(self):
+        return self._pos
+    
+    def _block(self, index):
+        if index not in self._blocks:
+            start = index * self._block_size
+            end = min(start + self._block_size, self.size) - 1
+            response = self._s3.get_object(Bucket=self._bucket_name, Key=self._object_key,
+                                           Range=f"bytes={start}-{end}")
+            self._blocks[index] = response['Body'].read()
+        return self._blocks[index]
+    
+    def readinto(self, buffer):
+        n = min(len(buffer), self.size - self._pos)
+        if n <= 0:
+            return 0
+        written = 0
+        while written < n:
+            index, offset = divmod(self._pos + written, self._block_size)
+            chunk = self._block(index)[offset:offset + n - written]
+            buffer[written:written + len(chunk)] = chunk
+            written += len(chunk)
+        self._pos += n
+        return n
+
+def get_s3_audio_info(bucket_name, object_key):
+    """
+    Get the duration of an S3 audio object from its header, without
+    downloading the audio data.
+    
+    WAV and FLAC store their length in the header, so only the first block
+    is fetched; other formats (or unreadable headers) fall back to a full
+    download.
+    
+    Parameters:
+        bucket_name (str): Name of the S3 bucket.
+        object_key (str): Key of the S3 object.
+    
+    Returns:
+        tuple: (duration in seconds, ETag of the object)
+    """
+    s3 = _get_s3()
+    if object_key.lower().endswith(('.wav', '.flac')):
+        try:
+            with _S3RangeReader(s3, bucket_name, object_key) as reader:
+                return get_audio_duration(reader), reader.etag
+        except Exception:
+            pass
+    
+    response = s3.get_object(Bucket=bucket_name, Key=object_key)
+    return get_audio_duration(io.BytesIO(response['Body'].read())), response['ETag']
+
+class ResultWriter:
+    """
+    Writes per-file JSON results and appends rows to results.csv.
+    
+    The CSV handle is opened once and kept for the whole run, and writes are
+    serialized with a lock so worker threads can share one writer.
     
     Parameters:
         output_dir (str): Directory to save results to.
-        file_id (str): ID of the audio file.
-        result (dict): Transcription result.
-        ground_truth (str, optional): Ground truth transcript.
-    """
-    # Calculate WER and CER if ground truth is available
-    if ground_truth and 'text' in result:
-        result['ground_truth'] = ground_truth
-        result['wer'] = wer(ground_truth.lower(), result['text'].lower())
-        result['cer'] = cer(ground_truth.lower(), result['text'].lower())
-    
-    # Save JSON result
-    json_path = os.path.join(output_dir, f"{file_id}.json")
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
-    
-    # Update CSV
-    csv_path = os.path.join(output_dir, 'results.csv')
-    csv_exists = os.path.exists(csv_path)
-    
-    with open(csv_path, 'a', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['file_id', 'ground_truth', 'hypothesis', 'wer', 'cer']
-        if 'confidence' in result:
-            fieldnames.append('confidence')
-        
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        pretty_json (bool): Indent the per-file JSON results.
+    """
+    
+    def __init__(self, output_dir, pretty_json=False):
+        self.output_dir = output_dir
+        self.pretty_json = pretty_json
+        self._lock = threading.Lock()
+        # The header is written by the caller; rows are appended after it
+        self._csvfile = open(os.path.join(output_dir, 'results.csv'), 'a', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._csvfile)
+    
+    def write(self, file_id, result, ground_truth=None):
+        """
+        Save transcription result as JSON and update CSV.
         
-        if not csv_exists:
-            writer.writeheader()
+        Parameters:
+            file_id (str): ID of the audio file.
+            result (dict): Transcription result.
+            ground_truth (str, optional): Ground truth transcript.
+        """
+        # Calculate WER and CER if ground truth is available; failed
+        # transcriptions are recorded but not scored
+        if ground_truth and 'text' in result and 'error' not in result:
+            result['ground_truth'] = ground_truth
+            # References that are only punctuation normalize to nothing, which
+            # jiwer can't score; they are recorded without WER/CER
+            if normalize_transcript(ground_truth):
+                hypothesis = result['text']
+                result['wer'] = process_words(
+                    ground_truth, hypothesis,
+                    reference_transform=WER_TRANSFORM, hypothesis_transform=WER_TRANSFORM
+                ).wer
+                result['cer'] = process_characters(
+                    ground_truth, hypothesis,
+                    reference_transform=CER_TRANSFORM, hypothesis_transform=CER_TRANSFORM
+                ).cer
         
         # Prepare row to write
-        row = {
-            'file_id': file_id,
-            'ground_truth': ground_truth if ground_truth else '',
-            'hypothesis': result.get('text', ''),
-            'wer': result.get('wer', ''),
-            'cer': result.get('cer', ''),
-        }
+        row = [
+            file_id,
+            ground_truth if ground_truth else '',
+            result.get('text', ''),
+            result.get('wer', ''),
+            result.get('cer', ''),
+        ]
         if 'confidence' in result:
-            row['confidence'] = result.get('confidence', '')
+            row.append(result.get('confidence', ''))
+        
+        payload = _dumps(result, self.pretty_json)
+        json_path = os.path.join(self.output_dir, f"{file_id}.json")
         
-        writer.writerow(row)
+        with self._lock:
+            # Save JSON result
+            with open(json_path, 'wb') as f:
+                f.write(payload)
+            
+            # Update CSV
+            self._writer.writerow(row)
+    
+    def close(self):
+        self._csvfile.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+def _params_hash(config):
+    """Stable hash of the model settings that can change its output."""
+    # Credentials and worker counts don't affect the transcript
+    params = {k: v for k, v in config.items() if k not in ('api_key', 'concurrency')}
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+def audio_digest(audio):
+    """
+    BLAKE2b hex digest of an audio file's contents.
+    
+    Parameters:
+        audio (str or bytes): Path to the audio file, or its contents.
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    if isinstance(audio, (bytes, bytearray)):
+        digest.update(audio)
+    else:
+        # Stream so large files are never held in memory just to be hashed
+        with open(audio, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def transcription_cache_path(cache_dir, model, audio):
+    """
+    Path of the cached result for an audio file, keyed by its content hash,
+    the model name and the model parameters.
+    
+    Parameters:
+        cache_dir (str): Cache directory.
+        model: An instance of a model class.
+        audio (str or bytes): Path to the audio file, or its contents.
+    """
+    key = f"{audio_digest(audio)}-{model.name}-{_params_hash(model.config)}"
+    return os.path.join(cache_dir, f"{key}.json")
+
+def load_cached_result(cache_path):
+    """Return the cached result at cache_path, or None on a miss."""
+    try:
+        with open(cache_path, 'rb') as f:
+            return orjson.loads(f.read()) if orjson else json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def store_cached_result(cache_path, result):
+    """Cache a successful result; failed transcriptions are retried next run."""
+    if 'error' in result:
+        return
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_dumps(result))
+    os.replace(tmp_path, cache_path)
+
+def transcribe_cached(model, audio, cache_dir, transcribe=None):
+    """
+    Transcribe audio, reusing a previous result for identical audio, model and parameters.
+    
+    Parameters:
+        model: An instance of a model class.
+        audio (str or bytes): Path to the audio file, or its contents.
+        cache_dir (str): Cache directory, or None to disable caching.
+        transcribe (callable, optional): Called with audio on a miss; defaults to model.transcribe.
+        
+    Returns:
+        dict: Transcription result.
+    """
+    transcribe = transcribe or model.transcribe
+    if not cache_dir:
+        return transcribe(audio)
+    
+    cache_path = transcription_cache_path(cache_dir, model, audio)
+    result = load_cached_result(cache_path)
+    if result is None:
+        result = transcribe(audio)
+        store_cached_result(cache_path, result)
+    return result
 
 def calculate_metrics(results):
     """
     Calculate aggregate metrics from a list of results.
     
+    Corpus-level WER/CER pool the edit operations over all files, so long
+    files weigh more than short ones; the averages weigh every file equally.
+    
     Parameters:
-        results (list): List of dictionaries with wer and cer keys.
+        results (list): List of dictionaries with wer and cer keys, and
+            optionally ground_truth and hypothesis for corpus-level scoring.
         
     Returns:
-        dict: Aggregated metrics including average WER and CER.
+        dict: Aggregated metrics including corpus-level and average WER and CER.
     """
     if not results:
-        return {'avg_wer': 0, 'avg_cer': 0, 'num_files': 0}
+        return {'wer': 0, 'cer': 0, 'avg_wer': 0, 'avg_cer': 0, 'num_files': 0}
     
     wer_sum = sum(r.get('wer', 0) for r in results if 'wer' in r)
     cer_sum = sum(r.get('cer', 0) for r in results if 'cer' in r)
     count = len(results)
     
+    # One batched jiwer call per metric over every scored file, skipping
+    # references that are empty after normalization
+    scored = [r for r in results
+              if 'ground_truth' in r and 'hypothesis' in r and normalize_transcript(r['ground_truth'])]
+    refs = [r['ground_truth'] for r in scored]
+    hyps = [r['hypothesis'] for r in scored]
+    corpus_wer = jiwer.wer(refs, hyps, reference_transform=WER_TRANSFORM,
+                           hypothesis_transform=WER_TRANSFORM) if scored else 0
+    corpus_cer = jiwer.cer(refs, hyps, reference_transform=CER_TRANSFORM,
+                           hypothesis_transform=CER_TRANSFORM) if scored else 0
+    
     return {
+        'wer': corpus_wer,
+        'cer': corpus_cer,
         'avg_wer': wer_sum / count if count > 0 else 0,
         'avg_cer': cer_sum / count if count > 0 else 0,
         'num_files': count